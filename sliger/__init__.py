@@ -7,39 +7,66 @@
 __version__ = "0.1.0" # Example version
 
 import ast
+import builtins
 import importlib
+import json
+import mimetypes
+import os
 import re
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from pprint import pprint
-from typing import Callable, Optional
+from typing import TYPE_CHECKING, Callable, Optional
 
-import toml
 import typer
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload
-from jinja2 import BaseLoader, Environment
+
+# The Google client libraries and Jinja2 are imported where they are used, so
+# that `sliger --help` and argument errors don't pay for loading them.
+if TYPE_CHECKING:
+    from jinja2 import Environment
 
 app = typer.Typer()
 state = {"verbose": False}
 
+# Matches text boxes holding an image placeholder such as ![image](path)
+_IMAGE_RE = re.compile(r"!\[image\]\((.*)\)")
+
+# Concurrent image replacements in imagify, kept low to stay within the
+# per-user API quota. Rate-limited calls are retried with backoff.
+_IMAGIFY_MAX_WORKERS = 8
+_NUM_RETRIES = 5
+_thread_local = threading.local()
+
+# Images up to this size are sent in a single request; larger ones use a
+# resumable upload with big chunks to keep the number of round trips low.
+_SIMPLE_UPLOAD_MAX_BYTES = 5 * 1024 * 1024
+_RESUMABLE_CHUNK_BYTES = 10 * 1024 * 1024
 
-# StringLoader is a custom Jinja2 template loader for rendering templates
-# provided as strings, instead of loading from files or other sources.
-class StringLoader(BaseLoader):
-    # get_source() returns a tuple (template, None, lambda: True) for Jinja2
-    # to load the template source, without a filename/path, and always up to date.
-    def get_source(self, environment, template):
-        return template, None, lambda: True
 
+def load_jinja_environment(config_path: str) -> "Environment":
+    from jinja2 import BaseLoader, Environment
+
+    # StringLoader is a custom Jinja2 template loader for rendering templates
+    # provided as strings, instead of loading from files or other sources.
+    class StringLoader(BaseLoader):
+        # get_source() returns a tuple (template, None, lambda: True) for Jinja2
+        # to load the template source, without a filename/path, and always up to date.
+        def get_source(self, environment, template):
+            return template, None, lambda: True
 
-def load_jinja_environment(config_path: str) -> Environment:
     if config_path:
-        with open(config_path) as f:
-            config = toml.load(f)
+        try:
+            import tomllib
+        except ModuleNotFoundError:  # Python < 3.11
+            import tomli as tomllib
+
+        with open(config_path, "rb") as f:
+            config = tomllib.load(f)
 
         def import_function(function_name: str) -> Callable:
             if "." in function_name:
@@ -47,7 +74,10 @@ def load_jinja_environment(config_path: str) -> Environment:
                 mod = importlib.import_module(mod_name)
                 res = getattr(mod, func_name)
             else:
-                res = getattr(globals(), function_name)
+                # Module-level functions first, then builtins
+                res = globals().get(function_name)
+                if res is None:
+                    res = getattr(builtins, function_name)
             return res
 
         function_map = config["function_map"]
@@ -58,21 +88,40 @@ def load_jinja_environment(config_path: str) -> Environment:
     else:
         function_map = {}
 
-    env = Environment(loader=StringLoader())
+    # Slide text ends with a newline, keep it so rendering static parts of a
+    # text box leaves them untouched
+    env = Environment(loader=StringLoader(), keep_trailing_newline=True)
     env.globals.update(function_map)
 
     return env
 
 
 def _get_slides_service():
-    """Builds and returns the Google Slides API service."""
-    return build("slides", "v1", credentials=state["creds"])
+    """Returns the Google Slides API service built in the app callback."""
+    return state["slides_service"]
+
 
+# Partial-response masks for presentations().get, so that each command only
+# downloads the parts of the presentation it actually reads. Element ids are
+# only fetched when verbose listings need to count the elements.
+_SLIDE_IDS_FIELDS = "slides/objectId"
+_SLIDE_ELEMENT_IDS_FIELDS = "slides(objectId,pageElements/objectId)"
+_TEXT_BOXES_FIELDS = (
+    "slides(objectId,pageElements(objectId,size,transform,"
+    "shape(shapeType,text/textElements/textRun/content)))"
+)
 
-def _get_presentation_slides(service, presentation_id: str) -> Optional[list]:
+
+def _get_presentation_slides(
+    service, presentation_id: str, fields: str = "slides(objectId,pageElements)"
+) -> Optional[list]:
     """Fetches and returns the slides of a presentation."""
     try:
-        presentation = service.presentations().get(presentationId=presentation_id).execute()
+        presentation = (
+            service.presentations()
+            .get(presentationId=presentation_id, fields=fields)
+            .execute()
+        )
         slides = presentation.get("slides")
         # The verbose printing will be handled by the calling functions
         # if state["verbose"]:
@@ -87,10 +136,12 @@ def _get_presentation_slides(service, presentation_id: str) -> Optional[list]:
 def duplicate_presentation(copy_title: str = typer.Option(...)):
     presentation_id = state["presentation_id"]
     try:
-        drive_service = build("drive", "v3", credentials=state["creds"])
+        drive_service = state["drive_service"]
         body = {"name": copy_title}
         drive_response = (
-            drive_service.files().copy(fileId=presentation_id, body=body).execute()
+            drive_service.files()
+            .copy(fileId=presentation_id, body=body, fields="id")
+            .execute()
         )
         presentation_copy_id = drive_response.get("id")
 
@@ -135,10 +186,19 @@ def delete_slide_by_id(service, presentation_id: str, slide_id: str):
     return response
 
 
-def _get_slide_id_by_index(slides: list, index: int) -> Optional[str]:
-    """Returns the objectId of a slide given its 1-based index."""
-    if 0 < index <= len(slides):
-        return slides[index - 1].get("objectId")
+def _get_slide_ids(slides: list) -> list:
+    """Returns the objectIds of the slides, in presentation order."""
+    return [slide.get("objectId") for slide in slides]
+
+
+def _get_slide_id_by_index(slide_ids: list, index: int) -> Optional[str]:
+    """Returns the objectId of a slide given its 1-based index.
+
+    Takes the list built by _get_slide_ids once, so several lookups on the
+    same presentation are plain list accesses.
+    """
+    if 0 < index <= len(slide_ids):
+        return slide_ids[index - 1]
     return None
 
 
@@ -160,14 +220,18 @@ def delete_slide(id: int = typer.Option(...)):
     presentation_id = state["presentation_id"]
     try:
         service = _get_slides_service()
-        slides = _get_presentation_slides(service, presentation_id)
+        slides = _get_presentation_slides(
+            service,
+            presentation_id,
+            _SLIDE_ELEMENT_IDS_FIELDS if state["verbose"] else _SLIDE_IDS_FIELDS,
+        )
 
         if not slides:
             return
 
         _print_slide_details_if_verbose(slides)
 
-        slide_to_delete_id = _get_slide_id_by_index(slides, slide_to_delete)
+        slide_to_delete_id = _get_slide_id_by_index(_get_slide_ids(slides), slide_to_delete)
 
         if slide_to_delete_id is None:
             print(
@@ -203,14 +267,18 @@ def duplicate_slide(id: int = typer.Option(...)):
     presentation_id = state["presentation_id"]
     try:
         service = _get_slides_service()
-        slides = _get_presentation_slides(service, presentation_id)
+        slides = _get_presentation_slides(
+            service,
+            presentation_id,
+            _SLIDE_ELEMENT_IDS_FIELDS if state["verbose"] else _SLIDE_IDS_FIELDS,
+        )
 
         if not slides:
             return
 
         _print_slide_details_if_verbose(slides)
 
-        slide_to_duplicate_id = _get_slide_id_by_index(slides, slide_to_duplicate)
+        slide_to_duplicate_id = _get_slide_id_by_index(_get_slide_ids(slides), slide_to_duplicate)
 
         if slide_to_duplicate_id is None:
             if state["verbose"]:
@@ -224,14 +292,9 @@ def duplicate_slide(id: int = typer.Option(...)):
             if state["verbose"]:
                 pprint(res)
 
-            # Call the Slides API again
-            presentation = (
-                service.presentations().get(presentationId=presentation_id).execute()
-            )
-            slides = presentation.get("slides")
-
+            # The duplicate adds exactly one slide, no need to fetch it again
             if state["verbose"]:
-                print("\n Now the presentation contains {} slides".format(len(slides)))
+                print("\n Now the presentation contains {} slides".format(len(slides) + 1))
 
     except HttpError as err:
         print(err)
@@ -242,43 +305,61 @@ def gslides_element_to_text(el: dict, object_id: str) -> dict:
     if "text" not in el["shape"]:
         return {"object_id": object_id, "text": ""}
 
-    text_contents = map(
-        lambda el: el["textRun"]["content"] if "textRun" in el else "",
-        el["shape"]["text"]["textElements"],
+    text = "".join(
+        text_el["textRun"]["content"]
+        for text_el in el["shape"]["text"]["textElements"]
+        if "textRun" in text_el
     )
 
-    text = "".join(text_contents)
+    # Not stripped: replaceAllText has to match the text exactly as it is on
+    # the slide, including its trailing newline
+    return {"object_id": object_id, "text": text}
+
+
+def _has_jinja(string: str) -> bool:
+    """Tells whether a string contains any Jinja expression, statement or comment."""
+    return "{{" in string or "{%" in string or "{#" in string
+
 
-    return {"object_id": object_id, "text": text.strip()}
+@lru_cache(maxsize=512)
+def _compile_template(env: "Environment", string: str):
+    """Compiles a template once per environment, so repeated slide text is
+    only lexed and parsed the first time it is seen."""
+    return env.from_string(string)
 
 
 def render_jinja_in_string(string: str, data: Optional[dict] = None) -> str:
     if data is None:
         data = {}
 
-    env = state["jinja_env"]
-    rtemplate = env.from_string(string)
+    rtemplate = _compile_template(state["jinja_env"], string)
 
-    return rtemplate.render(**data)
+    # Passed as a mapping rather than unpacked, so the caller's context is
+    # not copied once more on every call
+    return rtemplate.render(data)
 
 
-def strftime_with_ordinal(string: str, t) -> str:
-    def ordinal(n: int) -> str:
-        """
-        derive the ordinal numeral for a given number n
-        """
-        return f"{n:d}{'tsnrhtdd'[(n // 10 % 10 != 1) * (n % 10 < 4) * n % 10::4]}"
+def ordinal(n: int) -> str:
+    """
+    derive the ordinal numeral for a given number n
+    """
+    return f"{n:d}{'tsnrhtdd'[(n // 10 % 10 != 1) * (n % 10 < 4) * n % 10::4]}"
+
 
+# Every text element of a run is rendered with the same `now`, so identical
+# format strings are only formatted once.
+@lru_cache(maxsize=128)
+def strftime_with_ordinal(string: str, t) -> str:
     string = string.replace("%O", ordinal(t.tm_mday))
     return time.strftime(string, t)
 
 
-def text_update_to_gslides_request(change: dict) -> dict:
+def text_update_to_gslides_request(text: str, rendered_text: str, page_object_ids: list) -> dict:
     return {
         "replaceAllText": {
-            "containsText": {"text": change["text"], "matchCase": True},
-            "replaceText": change["rendered_text"],
-            "pageObjectIds": [change["object_id"]],
+            "containsText": {"text": text, "matchCase": True},
+            "replaceText": rendered_text,
+            "pageObjectIds": page_object_ids,
         }
     }
 
@@ -286,75 +367,96 @@ def text_update_to_gslides_request(change: dict) -> dict:
 def _get_text_elements_from_slide(slide: dict) -> list:
     """Extracts text box elements from a slide."""
     elements = slide.get("pageElements", [])
-    return list(filter(
-        lambda el: el.get("shape")
-        and el["shape"].get("shapeType") == "TEXT_BOX",
-        elements,
-    ))
+    return [
+        el
+        for el in elements
+        if (shape := el.get("shape")) and shape.get("shapeType") == "TEXT_BOX"
+    ]
+
+
+def _parse_data(data: str) -> dict:
+    """Parses the --data option, which is expected to be JSON. Python literals
+    (single quotes, True/None, ...) are still accepted as a fallback."""
+    try:
+        return json.loads(data)
+    except ValueError:
+        return ast.literal_eval(data)
 
 
 @app.command()
-def jinjify(data: str = typer.Option("{}", callback=ast.literal_eval)):
+def jinjify(data: str = typer.Option("{}", callback=_parse_data)):
     presentation_id = state["presentation_id"]
     try:
         service = _get_slides_service()
-        slides = _get_presentation_slides(service, presentation_id)
+        slides = _get_presentation_slides(service, presentation_id, _TEXT_BOXES_FIELDS)
 
         if not slides:
             return
 
         _print_slide_details_if_verbose(slides)
 
+        # Pages on which each (text, rendered_text) change occurs, so that a
+        # change repeated across slides becomes a single replaceAllText
+        updates = {}
+        render_ctx = {
+            "now": time.localtime(),
+            "strftime": strftime_with_ordinal,
+            **data,
+        }
+
         for i, slide in enumerate(slides):
             slide_id = slide.get("objectId")
 
             text_elements = _get_text_elements_from_slide(slide)
 
             texts = [gslides_element_to_text(el, slide_id) for el in text_elements]
-            updated_texts = []
             for text in texts:
-                rendered_text = render_jinja_in_string(
-                    text["text"],
-                    {
-                        "now": time.localtime(),
-                        "strftime": strftime_with_ordinal,
-                        **data,
-                    },
-                )
-                if rendered_text != text["text"]:
-                    text["rendered_text"] = rendered_text
-                    updated_texts.append(text)
+                # Static text can't change, don't pay for a Jinja render
+                if not _has_jinja(text["text"]):
+                    continue
 
-            gslides_update_requests = [
-                text_update_to_gslides_request(update) for update in updated_texts
-            ]
+                rendered_text = render_jinja_in_string(text["text"], render_ctx)
+                if rendered_text != text["text"]:
+                    page_ids = updates.setdefault((text["text"], rendered_text), [])
+                    if slide_id not in page_ids:
+                        page_ids.append(slide_id)
+
+        # Send the updates of every slide in one batchUpdate, longest text
+        # first so a shorter text can't rewrite a box a longer one must match
+        all_requests = [
+            text_update_to_gslides_request(text, rendered_text, page_ids)
+            for (text, rendered_text), page_ids in sorted(
+                updates.items(), key=lambda item: len(item[0][0]), reverse=True
+            )
+        ]
 
-            if len(gslides_update_requests) != 0:
-                if state["verbose"]:
-                    print("Executing changes", gslides_update_requests)
+        if len(all_requests) != 0:
+            if state["verbose"]:
+                print("Executing changes", all_requests)
 
-                body = {"requests": gslides_update_requests}
+            body = {"requests": all_requests}
 
-                response = (
-                    service.presentations()
-                    .batchUpdate(presentationId=state["presentation_id"], body=body)
-                    .execute()
-                )
-                print(response)
+            response = (
+                service.presentations()
+                .batchUpdate(presentationId=state["presentation_id"], body=body)
+                .execute()
+            )
+            print(response)
 
     except HttpError as err:
         print(err, file=sys.stderr)
 
 
 def upload_image(
-    service,
     drive_service,
-    presentation_id: str,
-    slide_id: str,
+    page_id: str,
     size=None,
     transform=None,
     img_path=None,
-):
+    http=None,
+) -> Optional[list]:
+    """Uploads an image to Drive and returns the Slides requests creating it
+    on the given page, or None if the upload failed."""
     if size is None:
         size = {
             "height": {"magnitude": 405, "unit": "PT"},
@@ -370,8 +472,19 @@ def upload_image(
         }
 
     try:
+        from googleapiclient.http import MediaFileUpload
+
         # Upload the image to Google Drive
-        media = MediaFileUpload(img_path, mimetype="image/jpeg", resumable=True)
+        mimetype = mimetypes.guess_type(img_path)[0] or "image/jpeg"
+        if os.path.getsize(img_path) <= _SIMPLE_UPLOAD_MAX_BYTES:
+            media = MediaFileUpload(img_path, mimetype=mimetype, resumable=False)
+        else:
+            media = MediaFileUpload(
+                img_path,
+                mimetype=mimetype,
+                chunksize=_RESUMABLE_CHUNK_BYTES,
+                resumable=True,
+            )
 
         img_file = (
             drive_service.files()
@@ -380,7 +493,7 @@ def upload_image(
                 media_body=media,
                 fields="id",
             )
-            .execute()
+            .execute(http=http, num_retries=_NUM_RETRIES)
         )
 
         # Make the image publicly accessible
@@ -390,16 +503,7 @@ def upload_image(
         }
         drive_service.permissions().create(
             fileId=img_file.get("id"), body=permission
-        ).execute()
-
-        # Get the presentation
-        presentation = (
-            service.presentations().get(presentationId=presentation_id).execute()
-        )
-        slides = presentation.get("slides")
-
-        # Select the target slide
-        page_id = slides[slide_id]["objectId"]
+        ).execute(http=http, num_retries=_NUM_RETRIES)
 
         # Define the request to add the image at the center of the slide.
         requests = [
@@ -415,31 +519,70 @@ def upload_image(
             }
         ]
 
-        # Execute the request.
+        return requests
+
+    except HttpError as error:
+        print(f"An error occurred: {error}", file=sys.stderr)
+
+    return None
+
+
+def _get_thread_http():
+    """Returns an authorized transport owned by the calling thread.
+
+    httplib2 connections are not thread-safe, so imagify workers can't share
+    state["http"]; each one keeps its own for all the images it handles.
+    """
+    http = getattr(_thread_local, "http", None)
+    if http is None:
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.http import build_http
+
+        http = AuthorizedHttp(state["creds"], http=build_http())
+        _thread_local.http = http
+    return http
+
+
+def _replace_text_with_image(
+    service,
+    drive_service,
+    presentation_id: str,
+    page_id: str,
+    text_element: dict,
+    image_path: str,
+):
+    http = _get_thread_http()
+    requests = upload_image(
+        drive_service,
+        page_id,
+        text_element["size"],
+        text_element["transform"],
+        image_path,
+        http=http,
+    )
+    if requests is None:
+        return
+
+    # Create the image and delete the placeholder text box in one round trip
+    requests.append({"deleteObject": {"objectId": text_element["objectId"]}})
+    try:
         response = (
             service.presentations()
             .batchUpdate(presentationId=presentation_id, body={"requests": requests})
-            .execute()
+            .execute(http=http, num_retries=_NUM_RETRIES)
         )
-
-        create_image_response = response.get("replies")[0].get("createImage")
-
-        if state["verbose"]:
-            print(
-                "Created image with ID: {0}".format(
-                    create_image_response.get("objectId")
-                )
-            )
-
     except HttpError as error:
         print(f"An error occurred: {error}", file=sys.stderr)
+        return
 
+    create_image_response = response.get("replies")[0].get("createImage")
 
-def delete_element(service, presentation_id: str, object_id: str):
-    service.presentations().batchUpdate(
-        presentationId=presentation_id,
-        body={"requests": [{"deleteObject": {"objectId": object_id}}]},
-    ).execute()
+    if state["verbose"]:
+        print(
+            "Created image with ID: {0}".format(
+                create_image_response.get("objectId")
+            )
+        )
 
 
 @app.command()
@@ -447,38 +590,47 @@ def imagify():
     presentation_id = state["presentation_id"]
     try:
         service = _get_slides_service()
-        drive_service = build("drive", "v3", credentials=state["creds"])
-        slides = _get_presentation_slides(service, presentation_id)
+        drive_service = state["drive_service"]
+        slides = _get_presentation_slides(service, presentation_id, _TEXT_BOXES_FIELDS)
 
         if not slides:
             return
 
         _print_slide_details_if_verbose(slides)
 
-        for i, slide in enumerate(slides):
+        render_ctx = {"now": time.localtime(), "strftime": strftime_with_ordinal}
+        # (slide id, text element, image path) of every placeholder found
+        image_jobs = []
+
+        for slide in slides:
             slide_id = slide.get("objectId")
 
             text_elements = _get_text_elements_from_slide(slide)
 
             for text_element in text_elements:
                 text = gslides_element_to_text(text_element, slide_id)
-                text = render_jinja_in_string(
-                    text["text"],
-                    {"now": time.localtime(), "strftime": strftime_with_ordinal},
-                )
-                image_match = re.fullmatch(r"!\[image\]\((.*)\)", text)
+                text = render_jinja_in_string(text["text"], render_ctx)
+                image_match = _IMAGE_RE.fullmatch(text.strip())
                 if image_match:
-                    image_path = image_match.group(1)
-                    upload_image(
-                        service,
-                        drive_service,
-                        presentation_id,
-                        i,
-                        text_element["size"],
-                        text_element["transform"],
-                        image_path,
-                    )
-                    delete_element(service, presentation_id, text_element["objectId"])
+                    image_jobs.append((slide_id, text_element, image_match.group(1)))
+
+        # Each replacement is a chain of independent round trips, so run them
+        # concurrently rather than one image after the other.
+        with ThreadPoolExecutor(max_workers=_IMAGIFY_MAX_WORKERS) as executor:
+            futures = [
+                executor.submit(
+                    _replace_text_with_image,
+                    service,
+                    drive_service,
+                    presentation_id,
+                    page_id,
+                    text_element,
+                    image_path,
+                )
+                for page_id, text_element, image_path in image_jobs
+            ]
+            for future in futures:
+                future.result()
 
     except HttpError as err:
         print(err, file=sys.stderr)
@@ -491,7 +643,31 @@ def main(
     config_path: str = typer.Option(None),
     verbose: bool = False,
 ):
+    from google.oauth2 import service_account
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build
+    from googleapiclient.http import build_http
+
     state["creds"] = service_account.Credentials.from_service_account_file(creds_file)
+    # A single authorized transport shared by both API clients, so every
+    # get/batchUpdate/upload reuses the same keep-alive HTTPS connections.
+    state["http"] = AuthorizedHttp(state["creds"], http=build_http())
+    # Build the API clients once per invocation, from the bundled discovery
+    # documents.
+    state["slides_service"] = build(
+        "slides",
+        "v1",
+        http=state["http"],
+        cache_discovery=False,
+        static_discovery=True,
+    )
+    state["drive_service"] = build(
+        "drive",
+        "v3",
+        http=state["http"],
+        cache_discovery=False,
+        static_discovery=True,
+    )
     state["presentation_id"] = presentation_id
     state["jinja_env"] = load_jinja_environment(config_path)
     state["verbose"] = verbose
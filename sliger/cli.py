@@ -1,25 +1,61 @@
 import ast
+import json
 import sys
 from pathlib import Path
 from typing import Any, Optional
 from pprint import pprint
 import re # Added for imagify
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import typer
-from google.oauth2 import service_account
 from googleapiclient.errors import HttpError # Keep for direct error handling in CLI if any
 
-from . import jinja_utils
+# google.oauth2 and jinja_utils (jinja2, tomllib) are imported where they are
+# first needed, so that `--help` and usage errors don't pay for loading them.
 from . import slides_utils
 from . import drive_utils
 
+try:
+    import orjson # Optional, faster JSON parsing for --data
+except ImportError:
+    orjson = None
+
 app = typer.Typer()
 
+# Matches text boxes holding an image placeholder such as ![image](path)
+_IMAGE_RE = re.compile(r"!\[image\]\((.*)\)")
+
+# Number of images imagify uploads to Drive concurrently
+_UPLOAD_MAX_WORKERS = 10
+_thread_local = threading.local()
+
 # Global state for the CLI application
 # This will hold credentials, presentation ID, Jinja environment, and verbose flag
 state: dict[str, Any] = {}
 
 
+@lru_cache(maxsize=4)
+def _load_credentials(creds_path: str, mtime: float):
+    """Loads service account credentials, cached on the file path and its
+    modification time so in-process re-invocations don't parse it again."""
+    from google.oauth2 import service_account
+
+    info = json.loads(Path(creds_path).read_bytes())
+    return service_account.Credentials.from_service_account_info(info)
+
+
+def _parse_data(data: str) -> dict:
+    """Parses the --data option as JSON, still accepting Python literals
+    (single quotes, True/None, ...) as a fallback."""
+    try:
+        return orjson.loads(data) if orjson else json.loads(data)
+    except ValueError:
+        return ast.literal_eval(data)
+
+
 @app.callback()
 def main(
     creds_file: Path = typer.Option(
@@ -47,11 +83,27 @@ def main(
     verbose: bool = typer.Option(False, "--verbose", "-v", help="Enable verbose output."),
 ):
     """Sliger: Automate Google Slides with Python and Jinja2."""
+    # Bound at module level, as this callback runs before every command
+    global jinja_utils
+    from . import jinja_utils
+
     try:
-        state["creds"] = service_account.Credentials.from_service_account_file(creds_file)
+        state["creds"] = _load_credentials(str(creds_file), creds_file.stat().st_mtime)
     except Exception as e:
         typer.echo(f"Error loading credentials from {creds_file}: {e}", err=True)
         raise typer.Exit(code=1)
+
+    # Build the API clients once, so commands reuse them (and their HTTP
+    # connections) instead of building their own. The builders use the
+    # discovery documents bundled with googleapiclient (static_discovery)
+    # rather than fetching them, and cache_discovery=False skips the
+    # file_cache warning.
+    try:
+        state["slides_service"] = slides_utils.get_slides_service(state["creds"])
+        state["drive_service"] = drive_utils.get_drive_service(state["creds"])
+    except Exception as e:
+        typer.echo(f"Error initializing Google API services: {e}", err=True)
+        raise typer.Exit(code=1)
         
     state["presentation_id"] = presentation_id
     state["verbose"] = verbose
@@ -71,13 +123,9 @@ def main(
 def duplicate_presentation(copy_title: str = typer.Option(..., help="Title for the new duplicated presentation.")):
     """Duplicates the presentation specified by --presentation-id."""
     presentation_id = state["presentation_id"]
-    creds = state["creds"]
     verbose = state["verbose"]
 
-    drive_service = drive_utils.get_drive_service(creds)
-    if not drive_service:
-        typer.echo("Failed to initialize Google Drive service.", err=True)
-        raise typer.Exit(code=1)
+    drive_service = state["drive_service"]
 
     if verbose:
         typer.echo(f"Attempting to duplicate presentation ID: {presentation_id} to '{copy_title}'")
@@ -111,20 +159,22 @@ def duplicate_presentation(copy_title: str = typer.Option(..., help="Title for t
 def delete_slide(slide_number: int = typer.Option(..., help="1-based index of the slide to delete.")):
     """Deletes a specific slide by its number (1-based index)."""
     presentation_id = state["presentation_id"]
-    creds = state["creds"]
     verbose = state["verbose"]
 
-    service = slides_utils.get_slides_service(creds)
-    if not service:
-        typer.echo("Failed to initialize Google Slides service.", err=True)
-        raise typer.Exit(code=1)
+    service = state["slides_service"]
 
-    slides = slides_utils.get_presentation_slides(service, presentation_id, verbose)
+    slides = slides_utils.get_presentation_slides(
+        service,
+        presentation_id,
+        verbose,
+        slides_utils.SLIDE_ELEMENT_IDS_FIELDS if verbose else slides_utils.SLIDE_IDS_FIELDS,
+    )
     if not slides:
         # Error already printed by get_presentation_slides or no slides found
         raise typer.Exit(code=1)
 
-    slides_utils.print_slide_details_if_verbose(slides, verbose) # This will print details before attempting delete
+    if verbose:
+        slides_utils.print_slide_details(slides) # This will print details before attempting delete
 
     slide_to_delete_id = slides_utils.get_slide_id_by_index(slides, slide_number)
 
@@ -153,19 +203,21 @@ def delete_slide(slide_number: int = typer.Option(..., help="1-based index of th
 def duplicate_slide(slide_number: int = typer.Option(..., help="1-based index of the slide to duplicate.")):
     """Duplicates a specific slide by its number (1-based index)."""
     presentation_id = state["presentation_id"]
-    creds = state["creds"]
     verbose = state["verbose"]
 
-    service = slides_utils.get_slides_service(creds)
-    if not service:
-        typer.echo("Failed to initialize Google Slides service.", err=True)
-        raise typer.Exit(code=1)
+    service = state["slides_service"]
 
-    slides_before = slides_utils.get_presentation_slides(service, presentation_id, verbose)
+    slides_before = slides_utils.get_presentation_slides(
+        service,
+        presentation_id,
+        verbose,
+        slides_utils.SLIDE_ELEMENT_IDS_FIELDS if verbose else slides_utils.SLIDE_IDS_FIELDS,
+    )
     if not slides_before:
         raise typer.Exit(code=1)
 
-    slides_utils.print_slide_details_if_verbose(slides_before, verbose)
+    if verbose:
+        slides_utils.print_slide_details(slides_before)
 
     slide_to_duplicate_id = slides_utils.get_slide_id_by_index(slides_before, slide_number)
 
@@ -188,114 +240,132 @@ def duplicate_slide(slide_number: int = typer.Option(..., help="1-based index of
         
         typer.echo(f"Slide #{slide_number} duplicated successfully.")
 
-        if verbose: # Fetch and show updated slide list if verbose
-            slides_after = slides_utils.get_presentation_slides(service, presentation_id, False) # verbose=False here to avoid double count message
-            if slides_after:
-                typer.echo(f"\nPresentation now contains {len(slides_after)} slides.")
-                # slides_utils.print_slide_details_if_verbose(slides_after, True) # Optionally print all details again
+        if verbose: # The duplication succeeded, so there is exactly one more slide
+            new_slide_id = response["replies"][0]["duplicateObject"]["objectId"]
+            typer.echo(f"New slide ID: {new_slide_id}")
+            typer.echo(f"\nPresentation now contains {len(slides_before) + 1} slides.")
 
     except HttpError as err:
         typer.echo(f"Error duplicating slide: {err}", err=True)
         raise typer.Exit(code=1)
 
 @app.command()
-def jinjify(data: str = typer.Option("{}", callback=ast.literal_eval, help="JSON string of data for Jinja rendering (e.g., '{\"name\": \"World\"}').")):
+def jinjify(data: str = typer.Option("{}", callback=_parse_data, help="JSON string of data for Jinja rendering (e.g., '{\"name\": \"World\"}').")):
     """Processes text in slides through Jinja2 for templating."""
     presentation_id = state["presentation_id"]
-    creds = state["creds"]
     verbose = state["verbose"]
     jinja_env = state["jinja_env"]
 
-    service = slides_utils.get_slides_service(creds)
-    if not service:
-        typer.echo("Failed to initialize Google Slides service.", err=True)
-        raise typer.Exit(code=1)
+    service = state["slides_service"]
 
-    slides = slides_utils.get_presentation_slides(service, presentation_id, verbose)
+    slides = slides_utils.get_presentation_slides(
+        service, presentation_id, verbose, slides_utils.TEXT_BOXES_FIELDS
+    )
     if not slides:
         raise typer.Exit(code=1)
 
-    slides_utils.print_slide_details_if_verbose(slides, verbose)
+    if verbose:
+        slides_utils.print_slide_details(slides)
 
     typer.echo("Processing slides for Jinja templating...")
     total_changes_made = 0
+    now = time.localtime()
+
+    # Collect the texts of all slides first, then render them all in one pass
+    text_runs = list(slides_utils.iter_text_runs(slides))
+    page_object_ids = [page_object_id for page_object_id, _, _ in text_runs]
+    object_ids = [object_id for _, object_id, _ in text_runs]
+    original_texts = [text for _, _, text in text_runs]
+    rendered_texts = [
+        jinja_utils.render_jinja_in_string(jinja_env, text, data, now) for text in original_texts
+    ]
+
+    changes = [
+        (page_object_id, object_id, original_text, rendered_text)
+        for page_object_id, object_id, original_text, rendered_text in zip(
+            page_object_ids, object_ids, original_texts, rendered_texts
+        )
+        if rendered_text != original_text
+    ]
+    changes_found = len(changes)
+    if verbose:
+        slide_numbers = {slide.get("objectId"): i + 1 for i, slide in enumerate(slides)}
+        typer.echo(f"Found {changes_found} text changes in {len(text_runs)} text boxes.")
 
-    for i, slide in enumerate(slides):
-        slide_id = slide.get("objectId")
+    # Slides on which each (original_text, rendered_text) change occurs, so a
+    # change repeated across slides becomes a single replaceAllText request
+    replacements: dict[tuple[str, str], list[str]] = {}
+    for page_object_id, object_id, original_text, rendered_text in changes:
         if verbose:
-            typer.echo(f"Processing Slide #{i + 1} ({slide_id})")
+            typer.echo(f"  Change on slide {slide_numbers[page_object_id]} (element {object_id}):")
+            typer.echo(f"    Original: '{original_text}'")
+            typer.echo(f"    Rendered: '{rendered_text}'")
+
+        slide_ids = replacements.setdefault((original_text, rendered_text), [])
+        if page_object_id not in slide_ids:
+            slide_ids.append(page_object_id)
+
+    # Updates of every slide, sent together in a single batchUpdate. Longest
+    # texts go first: a shorter text merged from another slide may be a
+    # substring of a longer one and would otherwise rewrite it before it matches.
+    all_requests = [
+        slides_utils.text_update_to_gslides_request(original_text, rendered_text, slide_ids)
+        for (original_text, rendered_text), slide_ids in sorted(
+            replacements.items(), key=lambda item: len(item[0][0]), reverse=True
+        )
+    ]
 
-        text_elements = slides_utils.get_text_elements_from_slide(slide)
-        if not text_elements:
+    if all_requests: # Only make the API call if there are changes at all
+        try:
             if verbose:
-                typer.echo(f"  No text elements found on Slide #{i+1}.")
-            continue # Skip to next slide if no text elements
-        
-        # Ensure parsed_texts and update_requests are within the loop for each slide
-        parsed_texts = [
-            slides_utils.gslides_element_to_text(el, slide_id) for el in text_elements
-        ]
-        update_requests = []
-
-        for text_info in parsed_texts:
-            original_text = text_info["text"]
-            rendered_text = jinja_utils.render_jinja_in_string(jinja_env, original_text, data)
-
-            if rendered_text != original_text:
-                if verbose:
-                    typer.echo(f"  Change on slide {i+1} (element {text_info['object_id']}):")
-                    typer.echo(f"    Original: '{original_text}'")
-                    typer.echo(f"    Rendered: '{rendered_text}'")
-                
-                update_request = slides_utils.text_update_to_gslides_request({
-                    "original_text": original_text,
-                    "rendered_text": rendered_text,
-                    "page_object_id": text_info["page_object_id"],
-                    "object_id": text_info["object_id"]
-                })
-                update_requests.append(update_request)
-
-        if update_requests: # Only make API call if there are changes for this slide
-            try:
-                if verbose:
-                    typer.echo(f"  Applying {len(update_requests)} text updates to slide #{i+1}...")
-                body = {"requests": update_requests}
-                service.presentations().batchUpdate(presentationId=presentation_id, body=body).execute()
-                total_changes_made += len(update_requests)
-                if verbose:
-                    typer.echo(f"  Successfully updated text on slide #{i+1}.")
-            except HttpError as err:
-                typer.echo(f"Error updating text on slide #{i+1}: {err}", err=True)
-        elif verbose:
-            typer.echo(f"  No text changes to apply on Slide #{i+1}.")
+                typer.echo(f"Applying {changes_found} text updates with {len(all_requests)} requests...")
+            body = {"requests": all_requests}
+            service.presentations().batchUpdate(presentationId=presentation_id, body=body).execute()
+            total_changes_made = changes_found
+            if verbose:
+                typer.echo("Successfully updated text.")
+        except HttpError as err:
+            typer.echo(f"Error updating text: {err}", err=True)
     # This line must be aligned with the `for` loop, i.e., outside it, but inside the function.
     typer.echo(f"Jinjify processing complete. Total text updates made: {total_changes_made}")
 
+def _upload_image(drive_service: Any, image_path: str, verbose: bool, folder_id: Optional[str]) -> Optional[str]:
+    """Uploads an image from an imagify worker thread, through the thread's
+    own transport (see drive_utils.build_authorized_http)."""
+    http = getattr(_thread_local, "http", None)
+    if http is None:
+        http = drive_utils.build_authorized_http(state["creds"])
+        _thread_local.http = http
+    return drive_utils.upload_image_to_drive(
+        drive_service, image_path, verbose, http=http, folder_id=folder_id
+    )
+
+
 @app.command()
 def imagify():
     """Replaces image placeholders like ![image](path) with actual images."""
     presentation_id = state["presentation_id"]
-    creds = state["creds"]
     verbose = state["verbose"]
     jinja_env = state["jinja_env"]
 
-    slides_service = slides_utils.get_slides_service(creds)
-    if not slides_service:
-        typer.echo("Failed to initialize Google Slides service.", err=True)
-        raise typer.Exit(code=1)
+    slides_service = state["slides_service"]
     
-    drive_service = drive_utils.get_drive_service(creds)
-    if not drive_service:
-        typer.echo("Failed to initialize Google Drive service.", err=True)
-        raise typer.Exit(code=1)
+    drive_service = state["drive_service"]
 
-    slides = slides_utils.get_presentation_slides(slides_service, presentation_id, verbose)
+    slides = slides_utils.get_presentation_slides(
+        slides_service, presentation_id, verbose, slides_utils.TEXT_BOXES_FIELDS
+    )
     if not slides:
         raise typer.Exit(code=1)
 
-    slides_utils.print_slide_details_if_verbose(slides, verbose)
+    if verbose:
+        slides_utils.print_slide_details(slides)
     typer.echo("Processing slides for image replacement...")
     total_images_replaced = 0
+    # (slide index, slide id, [(text box shape, image path), ...]) of every
+    # slide holding image placeholders
+    placeholders = []
+    now = time.localtime()
 
     for i, slide in enumerate(slides):
         slide_id = slide.get("objectId") # pageObjectId
@@ -307,25 +377,26 @@ def imagify():
             typer.echo(f"  No text elements found on Slide #{i+1}.")
             continue
 
+        slide_placeholders = []
+
         for text_element_shape in text_elements:
             # text_element_shape is a PageElement with shapeType TEXT_BOX
-            shape_id = text_element_shape.get("objectId")
             parsed_text_info = slides_utils.gslides_element_to_text(text_element_shape, slide_id)
             original_text = parsed_text_info["text"]
 
             # Render Jinja in the text, in case the image path itself is templated
             # Pass current slide index (0-based) and slide_id as potential Jinja context
             jinja_data_for_image_path = {"slide_index": i, "slide_id": slide_id}
-            rendered_text_content = jinja_utils.render_jinja_in_string(jinja_env, original_text, jinja_data_for_image_path)
+            rendered_text_content = jinja_utils.render_jinja_in_string(jinja_env, original_text, jinja_data_for_image_path, now)
 
-            image_match = re.fullmatch(r"!\[image\]\((.*)\)", rendered_text_content.strip())
+            image_match = _IMAGE_RE.fullmatch(rendered_text_content.strip())
 
             if image_match:
                 image_path_template = image_match.group(1)
                 # The path itself might be a Jinja expression, render it again if it looks like one.
                 # This is a simple check; more robust would be to always try rendering.
                 if "{{" in image_path_template and "}}" in image_path_template:
-                     image_path = jinja_utils.render_jinja_in_string(jinja_env, image_path_template, jinja_data_for_image_path).strip()
+                     image_path = jinja_utils.render_jinja_in_string(jinja_env, image_path_template, jinja_data_for_image_path, now).strip()
                 else:
                     image_path = image_path_template.strip()
                 
@@ -335,49 +406,89 @@ def imagify():
 
                 if verbose:
                     typer.echo(f"  Found image placeholder: '{rendered_text_content}' on slide #{i+1}. Path: '{image_path}'")
-                    typer.echo(f"  Uploading image '{image_path}' to Google Drive...")
 
-                drive_image_id = drive_utils.upload_image_to_drive(drive_service, image_path, verbose)
-                if not drive_image_id:
-                    typer.echo(f"  Failed to upload image '{image_path}' to Drive. Skipping replacement.", err=True)
-                    continue
+                slide_placeholders.append((text_element_shape, image_path))
+
+        if slide_placeholders:
+            placeholders.append((i, slide_id, slide_placeholders))
+
+    # Upload every distinct image once, several at a time: each upload is a
+    # couple of independent network round trips.
+    image_paths = list(dict.fromkeys(
+        image_path for _, _, slide_placeholders in placeholders for _, image_path in slide_placeholders
+    ))
+    # Uploading into a publicly shared folder spares a permission call per
+    # image; without it, each image is shared on its own as before.
+    folder_id = None
+    if image_paths:
+        folder_id = drive_utils.get_public_images_folder(drive_service, verbose)
+        if verbose:
+            typer.echo(f"Uploading {len(image_paths)} images to Google Drive...")
+    with ThreadPoolExecutor(max_workers=_UPLOAD_MAX_WORKERS) as executor:
+        drive_image_ids = dict(zip(
+            image_paths,
+            executor.map(lambda path: _upload_image(drive_service, path, verbose, folder_id), image_paths),
+        ))
+
+    for i, slide_id, slide_placeholders in placeholders:
+        # createImage/deleteObject pairs for every placeholder on this slide,
+        # applied together in one batchUpdate
+        slide_requests = []
+        slide_images = [] # (shape_id, image_path) in the order of slide_requests
+
+        for text_element_shape, image_path in slide_placeholders:
+            shape_id = text_element_shape.get("objectId")
+            drive_image_id = drive_image_ids[image_path]
+            if not drive_image_id:
+                typer.echo(f"  Failed to upload image '{image_path}' to Drive. Skipping replacement.", err=True)
+                continue
                 
-                image_url_on_drive = f"https://drive.google.com/uc?id={drive_image_id}"
-
-                # Use the properties of the existing text_element_shape for the new image
-                size = text_element_shape.get("size")
-                transform = text_element_shape.get("transform")
-
-                requests = [
-                    {
-                        "createImage": {
-                            "url": image_url_on_drive,
-                            "elementProperties": {
-                                "pageObjectId": slide_id, # slide_id is the pageObjectId
-                                "size": size,
-                                "transform": transform,
-                            },
-                        }
-                    },
-                    # Delete the original text box shape after image is created
-                    {"deleteObject": {"objectId": shape_id}}
-                ]
-
-                try:
-                    if verbose:
-                        typer.echo(f"  Replacing text box '{shape_id}' with image from '{image_path}' on slide #{i+1}.")
-                    
-                    body = {"requests": requests}
-                    response = slides_service.presentations().batchUpdate(presentationId=presentation_id, body=body).execute()
-                    
-                    create_image_response = response.get("replies")[0].get("createImage")
-                    if verbose and create_image_response:
+            image_url_on_drive = f"https://drive.google.com/uc?id={drive_image_id}"
+
+            # Use the properties of the existing text_element_shape for the new image
+            size = text_element_shape.get("size")
+            transform = text_element_shape.get("transform")
+
+            slide_requests += [
+                {
+                    "createImage": {
+                        "url": image_url_on_drive,
+                        "elementProperties": {
+                            "pageObjectId": slide_id, # slide_id is the pageObjectId
+                            "size": size,
+                            "transform": transform,
+                        },
+                    }
+                },
+                # Delete the original text box shape after image is created
+                {"deleteObject": {"objectId": shape_id}}
+            ]
+            slide_images.append((shape_id, image_path))
+
+        if not slide_requests:
+            continue
+
+        try:
+            if verbose:
+                for shape_id, image_path in slide_images:
+                    typer.echo(f"  Replacing text box '{shape_id}' with image from '{image_path}' on slide #{i+1}.")
+
+            body = {"requests": slide_requests}
+            response = slides_service.presentations().batchUpdate(presentationId=presentation_id, body=body).execute()
+            total_images_replaced += len(slide_images)
+
+            if verbose:
+                replies = response.get("replies")
+                # The k-th image's createImage reply is at index 2*k, followed
+                # by the (empty) reply of its deleteObject
+                for k in range(len(slide_images)):
+                    create_image_response = replies[2 * k].get("createImage")
+                    if create_image_response:
                         typer.echo(f"  Created image with ID: {create_image_response.get('objectId')}")
-                    total_images_replaced += 1
-                except HttpError as err:
-                    typer.echo(f"  Error replacing text box with image on slide #{i+1}: {err}", err=True)
-                except (IndexError, TypeError) as e:
-                    typer.echo(f"  Error parsing API response after image creation: {e}", err=True)
+        except HttpError as err:
+            typer.echo(f"  Error replacing text boxes with images on slide #{i+1}: {err}", err=True)
+        except (IndexError, TypeError) as e:
+            typer.echo(f"  Error parsing API response after image creation: {e}", err=True)
     
     typer.echo(f"Imagify processing complete. Total images replaced: {total_images_replaced}")
 
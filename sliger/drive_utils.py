@@ -1,14 +1,43 @@
+import mimetypes
+import os
 import sys
 from typing import Any
 
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload
+
+# Images up to this size are uploaded in a single request; only larger ones
+# go through a resumable upload session.
+RESUMABLE_UPLOAD_THRESHOLD = 5 * 1024 * 1024
+
+# Drive folder shared with "anyone with the link can read", holding the
+# uploaded images so they don't each need their own permission.
+PUBLIC_IMAGES_FOLDER_NAME = "sliger images"
+FOLDER_MIMETYPE = "application/vnd.google-apps.folder"
+
+# Retries (with exponential backoff) of the upload requests, which run
+# concurrently and so may hit Drive's rate limits.
+UPLOAD_NUM_RETRIES = 5
 
 
 def get_drive_service(creds: Any):
     """Builds and returns the Google Drive API service."""
-    return build("drive", "v3", credentials=creds)
+    from googleapiclient.discovery import build
+
+    return build(
+        "drive", "v3", credentials=creds, cache_discovery=False, static_discovery=True
+    )
+
+
+def build_authorized_http(creds: Any):
+    """Returns a new authorized HTTP transport for the given credentials.
+
+    httplib2 isn't thread-safe: threads issuing requests concurrently need one
+    each, passed as `http` when executing them.
+    """
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.http import build_http
+
+    return AuthorizedHttp(creds, http=build_http())
 
 
 def copy_file(drive_service: Any, file_id: str, copy_title: str) -> str | None:
@@ -45,39 +74,93 @@ def set_file_permissions_anyone_writer(drive_service: Any, file_id: str, verbose
         return None
 
 
-def upload_image_to_drive(drive_service: Any, image_path: str, verbose: bool) -> str | None:
+def get_public_images_folder(drive_service: Any, verbose: bool) -> str | None:
+    """Returns the ID of the publicly readable images folder, creating it if needed.
+
+    Files uploaded into this folder inherit its link sharing, which saves a
+    permissions call per uploaded image.
+    """
+    try:
+        query = (
+            f"name = '{PUBLIC_IMAGES_FOLDER_NAME}' and mimeType = '{FOLDER_MIMETYPE}'"
+            " and 'root' in parents and visibility = 'anyoneWithLink' and trashed = false"
+        )
+        folders = (
+            drive_service.files()
+            .list(q=query, fields="files(id)", pageSize=1)
+            .execute()
+            .get("files", [])
+        )
+        if folders:
+            return folders[0]["id"]
+
+        folder_metadata = {
+            "name": PUBLIC_IMAGES_FOLDER_NAME,
+            "mimeType": FOLDER_MIMETYPE,
+            "parents": ["root"],
+        }
+        folder = drive_service.files().create(body=folder_metadata, fields="id").execute()
+        folder_id = folder.get("id")
+
+        permission = {"type": "anyone", "role": "reader"}
+        drive_service.permissions().create(fileId=folder_id, body=permission).execute()
+
+        if verbose:
+            print(f"Created public images folder on Drive with ID: {folder_id}")
+
+        return folder_id
+    except HttpError as error:
+        print(f"An error occurred while setting up the images folder: {error}", file=sys.stderr)
+        return None
+
+
+def upload_image_to_drive(
+    drive_service: Any, image_path: str, verbose: bool, http: Any = None, folder_id: str | None = None
+) -> str | None:
     """Uploads an image to Google Drive and makes it publicly readable.
 
     Args:
         drive_service: Authorized Google Drive API service instance.
         image_path: Local path to the image file.
         verbose: Boolean for verbose output.
+        http: Optional HTTP transport to send the requests through, instead
+            of the service's own one.
+        folder_id: Optional ID of a publicly readable folder (see
+            get_public_images_folder) to upload into. The image then inherits
+            the folder's sharing and no permission is created for it.
 
     Returns:
         The ID of the uploaded image file on Google Drive, or None on error.
     """
+    from googleapiclient.http import MediaFileUpload
+
     try:
         # Upload the image to Google Drive
         # Use image_path for the name on Drive for easier identification
-        file_metadata = {"name": image_path, "parents": ["root"]}
-        media = MediaFileUpload(image_path, mimetype="image/jpeg", resumable=True)
+        file_metadata = {"name": image_path, "parents": [folder_id or "root"]}
+        mimetype = mimetypes.guess_type(image_path)[0] or "application/octet-stream"
+        resumable = os.path.getsize(image_path) > RESUMABLE_UPLOAD_THRESHOLD
+        media = MediaFileUpload(image_path, mimetype=mimetype, resumable=resumable)
 
         img_file = (
             drive_service.files()
             .create(body=file_metadata, media_body=media, fields="id")
-            .execute()
+            .execute(http=http, num_retries=UPLOAD_NUM_RETRIES)
         )
         img_file_id = img_file.get("id")
 
         if verbose:
             print(f"Uploaded image '{image_path}' to Drive with ID: {img_file_id}")
 
-        # Make the image publicly accessible (readable by anyone)
-        permission = {"type": "anyone", "role": "reader"}
-        drive_service.permissions().create(fileId=img_file_id, body=permission).execute()
+        if folder_id is None:
+            # Make the image publicly accessible (readable by anyone)
+            permission = {"type": "anyone", "role": "reader"}
+            drive_service.permissions().create(fileId=img_file_id, body=permission).execute(
+                http=http, num_retries=UPLOAD_NUM_RETRIES
+            )
 
-        if verbose:
-            print(f"Made image ID {img_file_id} publicly readable.")
+            if verbose:
+                print(f"Made image ID {img_file_id} publicly readable.")
 
         return img_file_id
     except HttpError as error:
@@ -1,16 +1,35 @@
+import builtins
 import importlib
 import time
+from functools import lru_cache
 from typing import Callable, Optional, Any
 
-import toml
 from jinja2 import BaseLoader, Environment
 
 
+# Ordinal numerals of every possible day of the month (1st, 2nd, ..., 31st)
+_ORDINALS: dict[int, str] = {
+    n: f"{n:d}{'tsnrhtdd'[(n // 10 % 10 != 1) * (n % 10 < 4) * n % 10::4]}"
+    for n in range(1, 32)
+}
+
+
+def _always_fresh() -> bool:
+    """Up-to-date check for StringLoader templates, which never go stale."""
+    return True
+
+
 class StringLoader(BaseLoader):
     """Custom Jinja2 template loader for rendering templates from strings."""
     def get_source(self, environment: Environment, template: str) -> tuple[str, None, Callable[[], bool]]:
         """Returns template source, no filename, and always up-to-date status.""" 
-        return template, None, lambda: True
+        return template, None, _always_fresh
+
+
+@lru_cache(maxsize=None)
+def _import_module(mod_name: str):
+    """Imports a module once, for config entries sharing the same module."""
+    return importlib.import_module(mod_name)
 
 
 def load_jinja_environment(config_path: Optional[str] = None) -> Environment:
@@ -18,21 +37,27 @@ def load_jinja_environment(config_path: Optional[str] = None) -> Environment:
     function_map = {}
     if config_path:
         try:
-            with open(config_path) as f:
-                config = toml.load(f)
+            import tomllib
+        except ModuleNotFoundError:  # Python < 3.11
+            import tomli as tomllib
+
+        try:
+            with open(config_path, "rb") as f:
+                config = tomllib.load(f)
 
             def import_function(function_name: str) -> Callable:
                 if "." in function_name:
                     mod_name, func_name = function_name.rsplit(".", 1)
-                    mod = importlib.import_module(mod_name)
+                    mod = _import_module(mod_name)
                     res = getattr(mod, func_name)
                 else:
                     # Attempt to import from global/built-in scope if not a module path
                     # This part might need to be more robust or restricted for security
-                    res = getattr(globals(), function_name, None)
+                    res = globals().get(function_name)
                     if res is None:
-                        # Try builtins as a last resort
-                        res = getattr(__builtins__, function_name, None)
+                        # Try builtins as a last resort. The builtins module
+                        # works whether __builtins__ is a module or a dict.
+                        res = getattr(builtins, function_name, None)
                     if res is None:
                         raise ImportError(f"Function {function_name} not found in global or built-in scope.")
                 return res
@@ -62,24 +87,41 @@ def strftime_with_ordinal(fmt: str, t: Optional[time.struct_time] = None) -> str
     if t is None:
         t = time.localtime()
 
-    def ordinal(n: int) -> str:
-        """Derive the ordinal numeral for a given number n."""
-        return f"{n:d}{'tsnrhtdd'[(n // 10 % 10 != 1) * (n % 10 < 4) * n % 10::4]}"
-
     # Python's strftime doesn't have a direct ordinal day, so we handle %O specially
     # Other format codes are passed to time.strftime
     # This simple replacement might not cover all edge cases of strftime, but is common.
-    return time.strftime(fmt.replace("%O", ordinal(t.tm_mday)), t)
+    return time.strftime(fmt.replace("%O", _ORDINALS[t.tm_mday]), t)
+
+
+@lru_cache(maxsize=512)
+def _compile(jinja_env: Environment, template_string: str):
+    """Compiles a template string, reusing the result for repeated text boxes."""
+    return jinja_env.from_string(template_string)
 
 
-def render_jinja_in_string(jinja_env: Environment, template_string: str, data: Optional[dict] = None) -> str:
-    """Renders a Jinja template string with the given data."""
+def render_jinja_in_string(
+    jinja_env: Environment,
+    template_string: str,
+    data: Optional[dict] = None,
+    now: Optional[time.struct_time] = None,
+) -> str:
+    """Renders a Jinja template string with the given data.
+
+    `now` defaults to the current local time; callers rendering many strings
+    can compute it once and pass it in.
+    """
+    # Most slide text isn't templated, skip compiling and rendering it
+    if "{{" not in template_string and "{%" not in template_string and "{#" not in template_string:
+        return template_string
+
     if data is None:
         data = {}
     
     # Add 'now' to the data context if not already present
     # This ensures 'now' is always available as in the original jinjify command
-    render_data = {"now": time.localtime(), **data}
+    if now is None:
+        now = time.localtime()
+    render_data = {"now": now, **data}
 
-    rtemplate = jinja_env.from_string(template_string)
+    rtemplate = _compile(jinja_env, template_string)
     return rtemplate.render(**render_data) 
\ No newline at end of file
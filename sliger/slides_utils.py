@@ -1,20 +1,70 @@
 import sys
-from typing import Optional, Any
+from typing import Iterator, Optional, Any
 
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 
 def get_slides_service(creds: Any):
     """Builds and returns the Google Slides API service."""
-    return build("slides", "v1", credentials=creds)
+    from googleapiclient.discovery import build
 
+    return build(
+        "slides", "v1", credentials=creds, cache_discovery=False, static_discovery=True
+    )
+
+
+# Partial-response masks for get_presentation_slides. Slide ids for
+# slide-level commands (with element ids too when verbose listings count the
+# elements), and the text boxes with their geometry for the text/image commands.
+SLIDE_IDS_FIELDS = "slides(objectId)"
+SLIDE_ELEMENT_IDS_FIELDS = "slides(objectId,pageElements/objectId)"
+TEXT_BOXES_FIELDS = (
+    "slides(objectId,pageElements(objectId,size,transform,"
+    "shape(shapeType,text(textElements(textRun(content))))))"
+)
+
+
+class LazySlide:
+    """A slide from the Slides API, whose text boxes are only looked up when
+    first asked for, and then kept.
+
+    Commands that only need slide ids never walk the page elements. Supports
+    `get()` like the raw slide dictionary it wraps.
+    """
+
+    __slots__ = ("_raw", "_text_elements", "objectId")
+
+    def __init__(self, raw: dict):
+        self._raw = raw
+        self._text_elements = None
+        self.objectId = raw.get("objectId")
 
-def get_presentation_slides(service: Any, presentation_id: str, verbose: bool) -> Optional[list]:
-    """Fetches and returns the slides of a presentation."""
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._raw.get(key, default)
+
+    @property
+    def text_elements(self) -> list:
+        """The text box elements of the slide."""
+        # Memoized by hand: functools.cached_property needs a __dict__
+        if self._text_elements is None:
+            self._text_elements = get_text_elements_from_slide(self._raw)
+        return self._text_elements
+
+
+def get_presentation_slides(
+    service: Any, presentation_id: str, verbose: bool, fields: Optional[str] = None
+) -> Optional[list[LazySlide]]:
+    """Fetches and returns the slides of a presentation.
+
+    If given, fields is a partial-response mask limiting what is downloaded.
+    """
     try:
-        presentation = service.presentations().get(presentationId=presentation_id).execute()
-        slides = presentation.get("slides")
+        presentation = (
+            service.presentations()
+            .get(presentationId=presentation_id, fields=fields)
+            .execute()
+        )
+        slides = [LazySlide(slide) for slide in presentation.get("slides", [])]
         if verbose:
             print(f"The presentation contains {len(slides)} slides:")
         return slides
@@ -30,25 +80,27 @@ def get_slide_id_by_index(slides: list, index: int) -> Optional[str]:
     return None
 
 
-def print_slide_details_if_verbose(slides: list, verbose: bool):
-    """Prints details of each slide if verbose mode is enabled."""
-    if verbose:
-        for i, slide in enumerate(slides):
-            slide_id = slide.get("objectId")
-            page_elements = slide.get("pageElements", [])
-            print(
-                f"- Slide #{i + 1} ({slide_id}) contains {len(page_elements)} elements."
-            )
+def print_slide_details(slides: list):
+    """Prints details of each slide."""
+    for i, slide in enumerate(slides):
+        slide_id = slide.get("objectId")
+        page_elements = slide.get("pageElements", [])
+        print(
+            f"- Slide #{i + 1} ({slide_id}) contains {len(page_elements)} elements."
+        )
 
 
-def get_text_elements_from_slide(slide: dict) -> list:
-    """Extracts text box elements from a slide."""
+def get_text_elements_from_slide(slide: dict | LazySlide) -> list:
+    """Extracts text box elements from a slide, either a raw API slide or a
+    LazySlide (whose text boxes are then only looked up once)."""
+    if isinstance(slide, LazySlide):
+        return slide.text_elements
     elements = slide.get("pageElements", [])
-    return list(filter(
-        lambda el: el.get("shape")
-        and el["shape"].get("shapeType") == "TEXT_BOX",
-        elements,
-    ))
+    return [
+        el
+        for el in elements
+        if (shape := el.get("shape")) and shape.get("shapeType") == "TEXT_BOX"
+    ]
 
 
 def gslides_element_to_text(el: dict, page_object_id: str) -> dict:
@@ -66,31 +118,45 @@ def gslides_element_to_text(el: dict, page_object_id: str) -> dict:
     if "text" not in el["shape"]:
         return {"object_id": shape_object_id, "page_object_id": page_object_id, "text": ""}
 
-    text_contents = map(
-        lambda text_el: text_el["textRun"]["content"] if "textRun" in text_el else "",
-        el["shape"]["text"]["textElements"],
+    text = "".join(
+        text_el["textRun"]["content"]
+        for text_el in el["shape"]["text"]["textElements"]
+        if "textRun" in text_el
     )
-    text = "".join(text_contents)
     return {"object_id": shape_object_id, "page_object_id": page_object_id, "text": text.strip()}
 
 
-def text_update_to_gslides_request(change: dict) -> dict:
-    """Converts a text change dictionary to a Google Slides API request.
+def iter_text_runs(slides: list[LazySlide]) -> Iterator[tuple[str, str, str]]:
+    """Yields (page_object_id, object_id, text) for every text box of every slide.
+
+    Walks the whole presentation in one go, so callers can process all texts
+    of all slides in a single pass instead of slide by slide.
+    """
+    for slide in slides:
+        slide_id = slide.objectId
+        for el in get_text_elements_from_slide(slide):
+            text_info = gslides_element_to_text(el, slide_id)
+            yield slide_id, text_info["object_id"], text_info["text"]
+
+
+def text_update_to_gslides_request(original_text: str, rendered_text: str, page_object_ids: list) -> dict:
+    """Builds the Google Slides API request replacing a text by its rendered version.
 
     Args:
-        change: A dictionary containing 'original_text', 'rendered_text',
-                'page_object_id' (slide ID), and 'object_id' (shape ID).
+        original_text: The text to look for.
+        rendered_text: The text to replace it with.
+        page_object_ids: IDs of the slides to apply the replacement on.
 
     Returns:
         A Google Slides API request dictionary for replaceAllText.
     """
     return {
         "replaceAllText": {
-            "containsText": {"text": change["original_text"], "matchCase": True},
-            "replaceText": change["rendered_text"],
-            "pageObjectIds": [change["page_object_id"]], # Targets the whole slide
+            "containsText": {"text": original_text, "matchCase": True},
+            "replaceText": rendered_text,
+            "pageObjectIds": page_object_ids, # Targets the whole slides
             # To target a specific shape, you'd use 'replaceAllShapesWithText' and provide the shape's objectId.
-            # This current structure assumes replacement across any text box on the specified slide
+            # This current structure assumes replacement across any text box on the specified slides
             # that matches 'containsText'. If specific shape targeting is needed,
             # the request structure and likely the calling logic needs to change.
         }